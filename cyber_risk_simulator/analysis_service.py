@@ -2,7 +2,10 @@ import pandas as pd
 import numpy as np
 import sqlite3
 from datetime import datetime
-from cyber_risk_simulator import CyberRiskSimulator 
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import List, Optional
+from cyber_risk_simulator import CyberRiskSimulator, get_revenue_bands_by_revenues
 from simulation_types import Industry, RevenueBand, SimulationMetrics
 import logging
 from config_setup import setup_config
@@ -10,23 +13,73 @@ from config_setup import setup_config
 # Load configuration data
 config_dict = setup_config()
 
+# Names of the industries the synthetic companies are drawn from
+INDUSTRY_NAMES = [e.slug for e in Industry]
+
+# Conservative bound on the number of bound parameters SQLite accepts in a single statement
+SQLITE_MAX_VARIABLES = 999
+
+# Maximum number of companies simulated by a single worker task, so large groups are spread across workers
+SIMULATION_CHUNK_SIZE = 64
+
+
+# SQLite connection shared by all the database operations, opened on first use
+_conn = None
+
+
+def _get_connection() -> sqlite3.Connection:
+    """
+    Return the shared SQLite connection, opening it on first use.
+
+    The connection is kept open rather than reopening the database file for every operation,
+    and runs in WAL mode with relaxed syncing, so bulk inserts are not dominated by journal
+    writes and fsyncs.
+    """
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(config_dict['db_path'], check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+    return _conn
+
+
+def _simulate_company_group(industry: Industry, revenue: float, num_companies: int,
+                            seed: Optional[np.random.SeedSequence] = None,
+                            attack_seed: Optional[np.random.SeedSequence] = None) -> List[SimulationMetrics]:
+    """
+    Simulate a group of companies sharing an industry and revenue band.
+
+    Defined at module level so it can be dispatched to worker processes.
+    """
+    simulator = CyberRiskSimulator(industry=industry, revenue=revenue, seed=seed, attack_seed=attack_seed)
+    return simulator.run_batch_simulation(num_companies)
+
+
 class AnalysisService:
     """
     This class is responsible for running simulations on synthetic companies,
     saving the simulation results and synthetic companies to a database,
     and retrieving these results when needed.
     """
-    def __init__(self, num_companies: int = 1000):
+    def __init__(self, num_companies: int = 1000, seed: Optional[int] = None, *, populate: bool = True):
         """
         Initialize the AnalysisService object.
         
         Parameters:
             num_companies (int, optional): The number of synthetic companies to generate.
                                            Default is 1000.
+            seed (int, optional): Seed of the random generators used to generate the synthetic companies
+                                  and to simulate them.
+            populate (bool, optional): Whether to generate the synthetic companies and save them to the database.
+                                       Services only reading back earlier results can skip it, but then
+                                       cannot run simulations. Default is True.
         """
         logging.info("Initializing AnalysisService.")
         self.num_companies = num_companies
-        self.companies = self._generate_synthetic_companies()
+        # Child seeds of this sequence are handed to the simulators
+        self._seed_sequence = np.random.SeedSequence(seed)
+        self._rng = np.random.default_rng(self._seed_sequence)
+        self.companies = self._generate_synthetic_companies() if populate else None
 
     def _generate_synthetic_companies(self) -> pd.DataFrame:
         """
@@ -37,22 +90,22 @@ class AnalysisService:
         """
         logging.debug("Generating synthetic companies.")
         # Generating company_id
-        company_ids = [company_id + 1 for company_id in range(self.num_companies)]
+        company_ids = np.arange(1, self.num_companies + 1, dtype=np.int32)
 
-        # Generating Revenue
-        revenues = np.random.uniform(1, 1000, self.num_companies)
-        revenues = np.round(revenues)
+        # Generating Revenue, rounded to the nearest million
+        revenues = np.rint(self._rng.uniform(1, 1000, self.num_companies)).astype(np.int32)
 
         # Generating Industry
-        industries = [e.name.lower() for e in Industry]  # Using enum for industries
-        industry_data = np.random.choice(industries, self.num_companies)
+        # Sampled as integer codes and stored as a categorical rather than an array of Python strings
+        industry_codes = self._rng.integers(0, len(INDUSTRY_NAMES), self.num_companies, dtype=np.int8)
+        industry_data = pd.Categorical.from_codes(industry_codes, categories=INDUSTRY_NAMES)
         
-        # Creating DataFrame
+        # Creating DataFrame from the typed arrays without copying them
         synthetic_companies_df = pd.DataFrame({
             'company_id': company_ids,
             'revenue_usd': revenues,
             'industry': industry_data
-        })
+        }, copy=False)
         
         self._save_synthetic_companies_to_db(synthetic_companies_df)
         
@@ -66,8 +119,16 @@ class AnalysisService:
             df (pd.DataFrame): DataFrame containing synthetic company data.
         """
         logging.debug("Saving synthetic companies to database.")
-        with sqlite3.connect(config_dict['db_path']) as conn:
-            df.to_sql(config_dict['synthetic_companies_table'], conn, if_exists='replace', index=False)
+        table = config_dict['synthetic_companies_table']
+        conn = _get_connection()
+        # Replace the table and insert all the companies in a single transaction
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"CREATE TABLE {table} (company_id INTEGER, revenue_usd INTEGER, industry TEXT)")
+            conn.executemany(f"INSERT INTO {table} (company_id, revenue_usd, industry) VALUES (?, ?, ?)",
+                             df[['company_id', 'revenue_usd', 'industry']].itertuples(index=False, name=None))
+            # Index the columns the web service segments the companies by
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_industry_revenue ON {table} (industry, revenue_usd)")
     
     def _save_simulation_to_db(self, df: pd.DataFrame):
         """
@@ -77,34 +138,75 @@ class AnalysisService:
             df (pd.DataFrame): DataFrame containing simulation results.
         """
         logging.debug("Saving simulation results to database.")
-        with sqlite3.connect(config_dict['db_path']) as conn:
-            df.to_sql(config_dict['simulations_table'], conn, if_exists='append', index=False)
+        with _get_connection() as conn:
+            df.to_sql(config_dict['simulations_table'], conn, if_exists='append', index=False,
+                      method='multi', chunksize=SQLITE_MAX_VARIABLES // len(df.columns))
+            # Index the column the web service looks up and joins the simulations by
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{config_dict['simulations_table']}_company_id "
+                         f"ON {config_dict['simulations_table']} (company_id)")
 
-    def run_simulations(self):
+    def run_simulations(self, max_workers: Optional[int] = None):
         """
         Run cyber risk simulations for the synthetic companies and save the results.
+
+        Companies are grouped by industry and revenue band, which determine the simulation
+        parameters, and each group is simulated in batches of at most SIMULATION_CHUNK_SIZE
+        companies. The batches are simulated in parallel worker processes, and splitting
+        the groups keeps the workers evenly loaded.
+
+        Parameters:
+            max_workers (int, optional): The number of worker processes. Defaults to the number of CPUs;
+                                         1 runs the simulations in the current process, as does a single batch.
         """
-        logging.debug("Running simulations.")
-        simulation_results = []
+        logging.debug(f"Running simulations with {max_workers=}.")
+
+        if self.companies is None:
+            logging.error("No synthetic companies to simulate, the service was created with populate=False.")
+            raise ValueError("No synthetic companies to simulate, the service was created with populate=False.")
 
-        for _, company in self.companies.iterrows():
-            industry = Industry.from_string(company['industry'])
-            simulator = CyberRiskSimulator(industry=industry, revenue=company['revenue_usd'])
-            metrics = simulator.run_simulation()
+        company_ids = self.companies['company_id'].to_numpy()
+        company_revenues = self.companies['revenue_usd'].to_numpy()
+        revenue_bands = get_revenue_bands_by_revenues(company_revenues)
+        # Only the row positions of each group are needed, so no per-group DataFrame is built
+        groups = self.companies.groupby(['industry', revenue_bands], sort=False, observed=True).indices
 
-            # Adding timestamp to each simulation
-            timestamp = datetime.now()
+        # Every batch position within a group gets its own attack count stream, shared by all the groups,
+        # so the companies at the same position of different groups are simulated with common random
+        # numbers, which correlates their attack counts (see CyberRiskSimulator._simulate_attacks).
+        # The costs are drawn from an independent stream per batch. The results are reproducible
+        # from the service seed whichever worker simulates a batch.
+        max_group_size = max(len(positions) for positions in groups.values())
+        batch_attack_seeds = self._seed_sequence.spawn(-(-max_group_size // SIMULATION_CHUNK_SIZE))
 
-            # Storing the results
-            simulation_results.append({
-                'company_id': company['company_id'],
-                'total_loss': metrics.total_loss,
-                'mean_loss': metrics.mean_loss,
-                'timestamp': timestamp
-            })
+        # Split every group into batches of companies
+        industries, revenues, batch_sizes, attack_seeds = [], [], [], []
+        for (industry_name, _), positions in groups.items():
+            industry = Industry.from_string(industry_name)
+            revenue = int(company_revenues[positions[0]])
+            for batch_index, start in enumerate(range(0, len(positions), SIMULATION_CHUNK_SIZE)):
+                industries.append(industry)
+                revenues.append(revenue)
+                batch_sizes.append(min(SIMULATION_CHUNK_SIZE, len(positions) - start))
+                attack_seeds.append(batch_attack_seeds[batch_index])
+        seeds = self._seed_sequence.spawn(len(batch_sizes))
 
-        # Convert the list of dictionaries to a DataFrame
-        results_df = pd.DataFrame(simulation_results)
+        # A single batch gains nothing from worker processes
+        if max_workers == 1 or len(batch_sizes) == 1:
+            batches_metrics = map(_simulate_company_group, industries, revenues, batch_sizes, seeds, attack_seeds)
+            metrics = list(chain.from_iterable(batches_metrics))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                batches_metrics = executor.map(_simulate_company_group, industries, revenues, batch_sizes, seeds, attack_seeds)
+                metrics = list(chain.from_iterable(batches_metrics))
+
+        # The batches are in group order, so the metrics line up with the companies of the concatenated groups
+        results_df = pd.DataFrame({
+            'company_id': company_ids[np.concatenate(list(groups.values()))],
+            'total_loss': [company_metrics.total_loss for company_metrics in metrics],
+            'mean_loss': [company_metrics.mean_loss for company_metrics in metrics],
+            # Adding timestamp to the simulations
+            'timestamp': datetime.now()
+        })
 
         # Save results to DB
         self._save_simulation_to_db(results_df)
@@ -119,7 +221,7 @@ class AnalysisService:
         
         logging.debug("Retrieving simulation results from database.")
         # Connect to SQLite database
-        with sqlite3.connect(config_dict['db_path']) as conn:
+        with _get_connection() as conn:
             # Query the table and load into a DataFrame
             return pd.read_sql(f"SELECT * FROM {config_dict['simulations_table']}", conn)
 
@@ -133,6 +235,6 @@ class AnalysisService:
         
         logging.debug("Retrieving synthetic companies from database.")
         # Connect to SQLite database
-        with sqlite3.connect(config_dict['db_path']) as conn:
+        with _get_connection() as conn:
             # Query the table and load into a DataFrame
             return pd.read_sql(f"SELECT * FROM {config_dict['synthetic_companies_table']}", conn)
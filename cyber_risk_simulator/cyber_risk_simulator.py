@@ -3,8 +3,9 @@ import pandas as pd
 import json
 import datetime
 from simulation_types import CostParam, FrequencyParam, MeanLoss, TotalLoss, RevenueBand, SimulationMetrics, revenue_band_dict, Industry
-from typing import Tuple
-from scipy.stats import poisson, norm
+from typing import List, Optional, Tuple, Union
+from functools import lru_cache
+from bisect import bisect_left
 import logging
 from config_setup import setup_config
 
@@ -14,6 +15,12 @@ config_dict = setup_config()
 # Initialize a global variable to cache statistical data
 stats_cache = None
 
+# Initialize a global variable to cache the frequency and cost tables built from the statistical data
+param_tables_cache = None
+
+# Above this attack frequency the Poisson CDF table gets long, so the normal approximation is used instead
+MAX_INVERSE_CDF_FREQUENCY = 100
+
 def load_stats():
     '''Load statistical data from a JSON file into a global cache variable.'''
     global stats_cache
@@ -23,46 +30,108 @@ def load_stats():
             stats_cache = json.load(f)
     return stats_cache
 
+def load_param_tables() -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Load the statistical data as two (industry, revenue band) tables of frequency and cost
+    parameters into a global cache variable, so parameter lookups are plain array indexing.
+    Rows follow the Industry Enum values and columns the RevenueBand Enum order;
+    combinations missing from the statistical data are NaN.
+    '''
+    global param_tables_cache
+    if param_tables_cache is None:
+        logging.debug('param_tables_cache is being rebuilt')
+        stats = load_stats()
+        freq_table = np.full((len(Industry), len(RevenueBand)), np.nan)
+        cost_table = np.full((len(Industry), len(RevenueBand)), np.nan)
+        for industry in Industry:
+            industry_stats = stats.get(industry.slug, {})
+            for band_index, band in enumerate(RevenueBand):
+                if band.value in industry_stats:
+                    freq_table[industry.value - 1, band_index] = industry_stats[band.value]['frequency']
+                    cost_table[industry.value - 1, band_index] = industry_stats[band.value]['cost']
+        param_tables_cache = freq_table, cost_table
+    return param_tables_cache
+
+# Probability mass allowed beyond the end of a tabulated Poisson CDF
+POISSON_CDF_TAIL_PROBABILITY = 1e-12
+
+@lru_cache(maxsize=None)
+def _poisson_cdf(freq: FrequencyParam) -> np.ndarray:
+    '''
+    Tabulate the Poisson CDF P(K <= k) for k = 0 .. k_max, where k_max is the first count
+    whose tail probability P(K > k_max) is below POISSON_CDF_TAIL_PROBABILITY.
+
+    Every simulator with the same frequency shares the cached table, so it is built once per
+    frequency and each attack count draw is then just a binary search in it.
+    '''
+    # Over 10 standard deviations past the mean, far enough to reach the tail bound
+    k_max = int(freq + 10 * np.sqrt(freq)) + 10
+    pmf = np.exp(-freq) * np.cumprod(np.concatenate(([1.0], freq / np.arange(1, k_max + 1))))
+    cdf = np.cumsum(pmf)
+    cdf = cdf[:np.searchsorted(cdf, 1 - POISSON_CDF_TAIL_PROBABILITY) + 1]
+    cdf.flags.writeable = False  # Shared through the cache
+    return cdf
+
+# Upper revenue boundary (in millions) of each revenue band, in the order of the RevenueBand Enum
+REVENUE_BAND_UPPER_BOUNDS = np.array([10, 100, 500, 1000])
+_REVENUE_BANDS = np.array(list(RevenueBand), dtype=object)
+_REVENUE_BAND_BOUNDARIES = {
+    band: (int(lower), int(upper))
+    for band, lower, upper in zip(RevenueBand, np.concatenate(([0], REVENUE_BAND_UPPER_BOUNDS[:-1])), REVENUE_BAND_UPPER_BOUNDS)
+}
+# Plain tuples of the same table for scalar lookups, which avoid the numpy call overhead
+_REVENUE_BAND_THRESHOLDS = tuple(REVENUE_BAND_UPPER_BOUNDS.tolist())
+_REVENUE_BAND_TUPLE = tuple(RevenueBand)
+
+def _get_revenue_band_index(revenue: float) -> int:
+    '''
+    Given a revenue value, this function returns the position of the
+    corresponding revenue band in the RevenueBand Enum.
+    '''
+    if not 0 <= revenue <= _REVENUE_BAND_THRESHOLDS[-1]:
+        logging.error(f"Invalid revenue: {revenue}")
+        raise ValueError(f"Invalid revenue: {revenue}")
+    return bisect_left(_REVENUE_BAND_THRESHOLDS, revenue)
+
+def _get_revenue_band_indices(revenues: np.ndarray) -> np.ndarray:
+    '''
+    Given an array of revenue values, this function returns the position of the
+    corresponding revenue bands in the RevenueBand Enum.
+    All revenues are mapped in a single binary search over the band boundaries.
+    '''
+    revenues = np.asarray(revenues)
+    invalid = ~((revenues >= 0) & (revenues <= REVENUE_BAND_UPPER_BOUNDS[-1]))
+    if invalid.any():
+        logging.error(f"Invalid revenue: {revenues[invalid][0]}")
+        raise ValueError(f"Invalid revenue: {revenues[invalid][0]}")
+    return np.searchsorted(REVENUE_BAND_UPPER_BOUNDS, revenues, side='left')
+
+def get_revenue_bands_by_revenues(revenues: np.ndarray) -> np.ndarray:
+    '''
+    Given an array of revenue values, this function returns an array of the
+    corresponding revenue bands as instances of the RevenueBand Enum.
+    '''
+    return _REVENUE_BANDS[_get_revenue_band_indices(revenues)]
+
 def get_revenue_band_by_revenue(revenue: int) -> RevenueBand:
     '''
     Given a revenue value, this function returns the corresponding revenue band
     as an instance of the RevenueBand Enum.
     '''
-    match revenue:
-        case x if x < 0:
-            logging.error(f"Invalid revenue: {revenue}")
-            raise ValueError(f"Invalid revenue: {revenue}")
-        case x if x <= 10:
-            return RevenueBand.BAND_10M
-        case x if x <= 100:
-            return RevenueBand.BAND_100M
-        case x if x <= 500:
-            return RevenueBand.BAND_500M
-        case x if x <= 1000:
-            return RevenueBand.BAND_1B
-        case _:
-            logging.error(f"Invalid revenue: {revenue}")
-            raise ValueError(f"Invalid revenue: {revenue}")
+    return _REVENUE_BAND_TUPLE[_get_revenue_band_index(revenue)]
             
+@lru_cache(maxsize=None)
 def get_revenue_boundaries_by_band(revenue_band: RevenueBand):
     '''
     Given a revenue band as an instance of the RevenueBand Enum,
     this function returns a tuple containing the lower and upper
     boundaries of that revenue band.
     '''
-    logging.debug(f"get_revenue_boundaries_by_band: {revenue_band.value=}")
-    match revenue_band:
-        case RevenueBand.BAND_10M:
-            return (0, 10)
-        case RevenueBand.BAND_100M:
-            return (10, 100)
-        case RevenueBand.BAND_500M:
-            return (100, 500)
-        case RevenueBand.BAND_1B:
-            return (500, 1000)
-        case _:
-            logging.error(f"Invalid revenue band: {revenue}")
-            raise ValueError(f"Invalid revenue band: {revenue_band}")
+    logging.debug(f"get_revenue_boundaries_by_band: {revenue_band=}")
+    if revenue_band not in _REVENUE_BAND_BOUNDARIES:
+        logging.error(f"Invalid revenue band: {revenue_band}")
+        raise ValueError(f"Invalid revenue band: {revenue_band}")
+    return _REVENUE_BAND_BOUNDARIES[revenue_band]
             
             
 def _get_industry_revenue_params(industry: Industry, revenue: float) -> Tuple[FrequencyParam, CostParam]:
@@ -85,23 +154,34 @@ def _get_industry_revenue_params(industry: Industry, revenue: float) -> Tuple[Fr
                     revenue band corresponding to the provided revenue is not found for the given industry.
 
     Notes:
-        - The method uses the `load_stats` function to load statistical data.
-        - The revenue is used to determine a revenue band using the `get_revenue_band_by_revenue` function.
+        - The method uses the `load_param_tables` function to load the statistical data as parameter tables.
+        - The revenue is mapped to a revenue band column using the `_get_revenue_band_index` function.
+        - The parameters of each (industry, revenue band) combination are cached by `_get_industry_band_params`.
     '''
-    stats = load_stats()
-    
-    if industry.name.lower() not in stats:
-        logging.error(f"Unknown industry: {industry}")
-        raise ValueError(f"Unknown industry: {industry}")
+    return _get_industry_band_params(industry, _get_revenue_band_index(revenue))
+
+
+@lru_cache(maxsize=None)
+def _get_industry_band_params(industry: Industry, band_index: int) -> Tuple[FrequencyParam, CostParam]:
+    '''
+    Retrieve frequency and cost parameters for a given industry and revenue band position.
+
+    There are only a handful of (industry, revenue band) combinations, so the lookups are cached
+    and computed once per combination rather than once per simulator.
+    '''
+    freq_table, cost_table = load_param_tables()
+    industry_index = industry.value - 1
     
-    revenue_band = get_revenue_band_by_revenue(revenue)
+    if np.isnan(freq_table[industry_index]).all():
+        logging.error(f"Unknown industry: {industry.name}")
+        raise ValueError(f"Unknown industry: {industry.name}")
     
-    if revenue_band.value not in stats[industry.name.lower()]:
-        logging.error(f"Invalid revenue band: {revenue_band} for industry: {industry}")
-        raise ValueError(f"Invalid revenue band: {revenue_band} for industry: {industry}")
+    if np.isnan(freq_table[industry_index, band_index]):
+        logging.error(f"Invalid revenue band: {_REVENUE_BANDS[band_index]} for industry: {industry.name}")
+        raise ValueError(f"Invalid revenue band: {_REVENUE_BANDS[band_index]} for industry: {industry.name}")
         
-    frequency = stats[industry.name.lower()][revenue_band.value]['frequency']
-    cost = stats[industry.name.lower()][revenue_band.value]['cost']
+    frequency = float(freq_table[industry_index, band_index])
+    cost = float(cost_table[industry_index, band_index])
     
     return frequency, cost
 
@@ -116,50 +196,118 @@ class CyberRiskSimulator:
         num_simulations (int): Number of simulations to perform.
         freq_param (FrequencyParam): Frequency parameter for Poisson distribution.
         sev_param (CostParam): Severity parameter for normal distribution.
-        results (DataFrame): A dataframe to store the results of the simulation.
+        results (DataFrame): The per-attack results of the last run saved to CSV, None until then.
+        _rng (np.random.Generator): Random generator used for sampling the costs, seeded with `seed`.
+        _attack_rng (np.random.Generator): Random generator used for sampling the attack counts, seeded with
+                                           `attack_seed` if given and otherwise the same generator as `_rng`.
     '''
-    def __init__(self, industry: Industry, revenue: float, num_simulations: int = 10_000):
-        '''Initialize CyberRiskSimulator with industry, revenue, and number of simulations.'''
-        logging.debug(f'Init of CyberRiskSimulator with {industry=}, {revenue=}, {num_simulations=}')
+    def __init__(self, industry: Industry, revenue: float, num_simulations: int = 10_000,
+                 seed: Optional[Union[int, np.random.SeedSequence]] = None,
+                 attack_seed: Optional[Union[int, np.random.SeedSequence]] = None):
+        '''Initialize CyberRiskSimulator with industry, revenue, number of simulations and optional random seeds.'''
+        logging.debug(f'Init of CyberRiskSimulator with {industry=}, {revenue=}, {num_simulations=}, {seed=}, {attack_seed=}')
         self.industry = industry
         self.revenue = revenue
         self.num_simulations = num_simulations
+        self._rng = np.random.default_rng(seed)
+        self._attack_rng = self._rng if attack_seed is None else np.random.default_rng(attack_seed)
         self.freq_param, self.sev_param = _get_industry_revenue_params(industry, revenue)
-        self.results = pd.DataFrame(columns=['simulation_id', 'attack_id', 'cost'])  # To store results
+        self.results = None  # Built from the recorded attack arrays only when saved to CSV
+        self._simulation_ids = self._attack_ids = self._attack_costs = None
+
+    def _simulate_attacks(self, num_companies: Optional[int] = None) -> np.ndarray:
+        '''
+        Simulate the number of attacks using a Poisson distribution.
+
+        Counts are sampled by inverting the Poisson CDF on uniform draws, so simulators sharing an
+        attack seed use the same random numbers whatever their frequency parameter (up to
+        MAX_INVERSE_CDF_FREQUENCY, above which a normal approximation is drawn). Their attack counts
+        are then positively correlated, which reduces the variance of comparisons between them.
+        AnalysisService.run_simulations shares attack seeds this way between the companies at the same
+        position of different (industry, revenue band) groups, while their costs stay independent.
 
-    def _simulate_attacks(self) -> np.ndarray:
-        '''Simulate the number of attacks using a Poisson distribution.'''
-        return poisson.rvs(self.freq_param, size=self.num_simulations)
+        Parameters:
+            num_companies (int, optional): When given, simulate the attacks of that many companies at once
+                                           and return a (num_companies, num_simulations) array.
+
+        Returns:
+            np.ndarray: The number of attacks for each simulation run.
+        '''
+        size = self.num_simulations if num_companies is None else (num_companies, self.num_simulations)
+        if self.freq_param > MAX_INVERSE_CDF_FREQUENCY:
+            normal_draws = self._attack_rng.standard_normal(size)
+            return np.maximum(np.rint(self.freq_param + np.sqrt(self.freq_param) * normal_draws), 0).astype(np.int64)
+
+        return np.searchsorted(_poisson_cdf(self.freq_param), self._attack_rng.random(size), side='right')
  
-    def _simulate_losses(self, attack_counts: np.ndarray) -> np.ndarray:
+    def _simulate_losses(self, attack_counts: np.ndarray, record_attacks: bool = False) -> np.ndarray:
         '''
         Simulate the losses for a given number of attacks.
 
+        All attack costs are drawn in a single vectorized call and summed per simulation run,
+        so no Python-level loop is executed over the simulations or the attacks.
+
         Parameters:
             attack_counts (np.ndarray): The number of attacks for each simulation run.
+            record_attacks (bool, optional): Whether to keep the per-attack ids and costs of this run
+                                             as arrays for `_save_results_to_csv`. Default is False.
 
         Returns:
             np.ndarray: Array containing the total loss for each simulation run.
         '''
         losses = np.zeros(len(attack_counts))
-        data_to_append = []  # Accumulate data in this list
-        
-        # loop over all simulations
-        for i, attack_count in enumerate(attack_counts):
-            # loop over all attacks of the current simulation
-            for attack_id in range(attack_count):
-                cost = norm.rvs(self.sev_param, self.sev_param * 0.1)  # 10% std deviation
-                data_to_append.append({
-                    'simulation_id': i + 1,
-                    'attack_id': attack_id + 1,
-                    'cost': cost
-                })
-                losses[i] += cost
-    
-        self.results = pd.concat([self.results, pd.DataFrame(data_to_append)], ignore_index=True)
-        
+        total_attacks = int(attack_counts.sum())
+
+        # No attack in any simulation run: nothing to sample, sum or record
+        if total_attacks == 0:
+            if record_attacks:
+                self._simulation_ids = self._attack_ids = np.empty(0, dtype=np.int32)
+                self._attack_costs = np.empty(0, dtype=np.float32)
+            return losses
+
+        # Costs are sampled in single precision, which is plenty for dollar amounts and halves the memory traffic
+        cost_mean, cost_std = np.float32(self.sev_param), np.float32(self.sev_param * 0.1)  # 10% std deviation
+        costs = cost_mean + cost_std * self._rng.standard_normal(total_attacks, dtype=np.float32)
+
+        # Costs are laid out simulation after simulation, so each non-empty simulation
+        # is a contiguous slice starting at the cumulative count of the previous ones
+        has_attacks = attack_counts > 0
+        offsets = np.cumsum(attack_counts) - attack_counts
+        losses[has_attacks] = np.add.reduceat(costs, offsets[has_attacks], dtype=np.float64)
+
+        if record_attacks:
+            # Per-attack columns are filled directly as typed arrays, without per-attack objects
+            self._simulation_ids = np.repeat(np.arange(1, len(attack_counts) + 1, dtype=np.int32), attack_counts)
+            self._attack_ids = np.arange(1, total_attacks + 1, dtype=np.int32)
+            self._attack_ids -= np.repeat(offsets.astype(np.int32), attack_counts)
+            self._attack_costs = costs
+
         return losses
  
+    def _simulate_total_losses(self, attack_counts: np.ndarray) -> np.ndarray:
+        '''
+        Simulate the total loss of each simulation run without sampling the individual attacks.
+
+        The sum of k independent N(mu, sigma^2) costs is distributed N(k * mu, k * sigma^2),
+        so a single draw per simulation run yields the same loss distribution as summing
+        the per-attack costs drawn by `_simulate_losses`.
+
+        Parameters:
+            attack_counts (np.ndarray): The number of attacks for each simulation run, of any shape.
+
+        Returns:
+            np.ndarray: Array of the same shape containing the total loss for each simulation run.
+        '''
+        # Simulation runs without attacks have no loss, so only the others are sampled
+        losses = np.zeros(attack_counts.shape)
+        has_attacks = attack_counts > 0
+        attack_counts = attack_counts[has_attacks]
+        # The standard normals are sampled in single precision; the losses are computed in double precision
+        normal_draws = self._rng.standard_normal(attack_counts.shape, dtype=np.float32)
+        losses[has_attacks] = self.sev_param * attack_counts + \
+                              self.sev_param * 0.1 * np.sqrt(attack_counts) * normal_draws  # 10% std deviation per attack
+        return losses
+
     def _save_results_to_csv(self):
         '''Save the simulation results to a CSV file.'''
         logging.debug('saving simulation results of CyberRiskSimulator to csv')
@@ -169,7 +317,12 @@ class CyberRiskSimulator:
         # Compose the filename
         filename = f"simulation_results_{timestamp_str}.csv"
         
-        # Save to CSV
+        # Build the results table from the recorded attack arrays and save it to CSV
+        self.results = pd.DataFrame({
+            'simulation_id': self._simulation_ids,
+            'attack_id': self._attack_ids,
+            'cost': self._attack_costs
+        }, copy=False)
         self.results.to_csv(filename, index=False)
         
         
@@ -201,26 +354,81 @@ class CyberRiskSimulator:
         '''
         logging.debug('started run_simulation of CyberRiskSimulator')
         attack_counts = self._simulate_attacks()
-        losses = self._simulate_losses(attack_counts)
-        
+
+        # The individual attack costs are only needed for the CSV output
         if save_to_csv:
+            losses = self._simulate_losses(attack_counts, record_attacks=True)
             self._save_results_to_csv()
-            
-        # Compute metrics
-        total_loss = np.sum(losses)
-        mean_loss = np.mean(losses)
-        median_loss = np.median(losses)
-        std_dev_loss = np.std(losses)
-        min_loss = np.min(losses)
-        max_loss = np.max(losses)
-        percentile_95_loss = np.percentile(losses, 95)
-
-
-        return SimulationMetrics(
-            total_loss=total_loss, 
-            mean_loss=mean_loss,
-            median_loss=median_loss,
-            std_dev_loss=std_dev_loss,
-            min_loss=min_loss,
-            max_loss=max_loss,
-            percentile_95_loss=percentile_95_loss)
+        else:
+            losses = self._simulate_total_losses(attack_counts)
+
+        return SimulationMetrics(*map(float, _compute_metrics(losses)))
+
+    def run_batch_simulation(self, num_companies: int) -> List[SimulationMetrics]:
+        '''
+        Run the cyber risk simulation for several companies sharing this simulator's parameters.
+
+        All companies in the same industry and revenue band share the frequency and cost
+        parameters, so their simulations are drawn together in one vectorized pass instead
+        of constructing and running one simulator per company.
+
+        Parameters:
+            num_companies (int): The number of companies to simulate.
+
+        Returns:
+            List[SimulationMetrics]: The loss metrics of each company, in simulation order.
+        '''
+        logging.debug(f'started run_batch_simulation of CyberRiskSimulator for {num_companies=}')
+        attack_counts = self._simulate_attacks(num_companies)
+        losses = self._simulate_total_losses(attack_counts)
+        metrics = _compute_metrics(losses)
+        return [SimulationMetrics(*map(float, company_metrics)) for company_metrics in zip(*metrics)]
+
+
+def _compute_metrics(losses: np.ndarray) -> SimulationMetrics:
+    '''
+    Compute the loss metrics over the last axis of `losses`.
+
+    For a 1-D array of simulation losses every metric is a scalar; for a 2-D array
+    (one row per company) every metric is an array with one value per row.
+
+    The order statistics (minimum, median, 95th percentile and maximum) all come from a single
+    partition rather than a separate pass each. The quantiles use the same linear
+    interpolation as np.percentile.
+
+    The reduction works in place to avoid allocating temporaries as large as `losses`:
+    the array is reordered and then overwritten, so callers must not reuse it.
+    '''
+    num_runs = losses.shape[-1]
+    total_loss = np.sum(losses, axis=-1)
+    mean_loss = total_loss / num_runs
+
+    median_position = 0.5 * (num_runs - 1)
+    percentile_95_position = 0.95 * (num_runs - 1)
+    order_positions = sorted({0, num_runs - 1,
+                              int(np.floor(median_position)), int(np.ceil(median_position)),
+                              int(np.floor(percentile_95_position)), int(np.ceil(percentile_95_position))})
+    losses.partition(order_positions, axis=-1)
+
+    def quantile(position: float) -> np.ndarray:
+        lower, upper = losses[..., int(np.floor(position))], losses[..., int(np.ceil(position))]
+        return lower + (position - np.floor(position)) * (upper - lower)
+
+    median_loss = quantile(median_position)
+    percentile_95_loss = quantile(percentile_95_position)
+    min_loss = losses[..., 0].copy()
+    max_loss = losses[..., num_runs - 1].copy()
+
+    # Squared deviations from the mean, reusing the losses buffer
+    losses -= np.expand_dims(mean_loss, -1)
+    np.square(losses, out=losses)
+    std_dev_loss = np.sqrt(np.mean(losses, axis=-1))
+
+    return SimulationMetrics(
+        total_loss=total_loss,
+        mean_loss=mean_loss,
+        median_loss=median_loss,
+        std_dev_loss=std_dev_loss,
+        min_loss=min_loss,
+        max_loss=max_loss,
+        percentile_95_loss=percentile_95_loss)
@@ -1,4 +1,4 @@
-from enum import Enum, auto
+from enum import Enum, IntEnum
 from typing import NamedTuple
 import logging
 
@@ -65,15 +65,25 @@ def parse_revenue_band(band_str: str) -> RevenueBand:
 
 
 
-class Industry(Enum):
+class Industry(IntEnum):
     """
     Enum to represent different types of industries for companies.
+
+    The members are integers, so they hash and compare as such, e.g. when used as
+    cache keys or to index the parameter tables.
     """
-    HEALTHCARE = auto()  # 1
-    FINANCE = auto()  # 2
-    RETAIL = auto()  # 3
-    MANUFACTURING = auto()  # 4
-    CONSTRUCTION = auto()  # 5
+    HEALTHCARE = 1
+    FINANCE = 2
+    RETAIL = 3
+    MANUFACTURING = 4
+    CONSTRUCTION = 5
+
+    @property
+    def slug(self) -> str:
+        """
+        The lowercase name of the industry, as used in the statistical data, the database and the web service.
+        """
+        return self.name.lower()
     
     @classmethod
     def from_string(cls, industry_str: str):
@@ -1,8 +1,9 @@
 from flask import Flask, jsonify, request
 import sqlite3
+import threading
 import logging
 from cyber_risk_simulator import get_revenue_boundaries_by_band
-from simulation_types import parse_revenue_band
+from simulation_types import parse_revenue_band, revenue_band_dict, Industry
 from scipy.stats import poisson, norm
 from functools import lru_cache
 from config_setup import setup_config
@@ -13,6 +14,45 @@ config_dict = setup_config()
 # Initialize the Flask web service
 app = Flask(__name__)
 
+# Accepted values of the segmentation query parameters, checked before any query is built
+VALID_REVENUE_BANDS = frozenset(revenue_band_dict)
+VALID_INDUSTRIES = frozenset(industry.slug for industry in Industry)
+
+# SQLite connection shared by all the requests, opened on first use.
+# Flask's development server handles every request in a new thread, so the connection is shared
+# across threads and the lock serialises its use.
+_conn = None
+_conn_lock = threading.Lock()
+
+
+def get_db_connection() -> sqlite3.Connection:
+    '''
+    Return the shared read-only SQLite connection, opening it on first use.
+    Must be called with `_conn_lock` held.
+
+    Keeping the connection open avoids reopening the database file and losing its page cache
+    on every query. Memory-mapped I/O lets the aggregate scans read pages straight from the OS page cache.
+    '''
+    global _conn
+    if _conn is None:
+        logging.debug('opening database connection')
+        _conn = sqlite3.connect(config_dict['db_path'], isolation_level=None, check_same_thread=False)
+        _conn.execute('PRAGMA cache_size=-131072')  # 128 MiB page cache
+        _conn.execute('PRAGMA mmap_size=268435456')  # Read up to 256 MiB of the file through memory-mapped I/O
+        _conn.execute('PRAGMA temp_store=MEMORY')
+        _conn.execute('PRAGMA query_only=1')
+    return _conn
+
+
+def fetch_one_from_db(query: str, params) -> tuple:
+    '''
+    Helper function used to execute a query on the shared connection and return its first row.
+    '''
+    with _conn_lock:
+        cursor = get_db_connection().cursor()
+        cursor.execute(query, params)
+        return cursor.fetchone()
+
 
 @app.route('/', methods=['GET'])
 def welcome():
@@ -39,10 +79,7 @@ def fetch_cost_by_company_from_db(company_id:int):
 
     """
     logging.debug(f'executing query for {company_id=}')
-    with sqlite3.connect(config_dict['db_path']) as conn:
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT mean_loss FROM {config_dict['simulations_table']} WHERE company_id = ?", (company_id,))
-        return cursor.fetchone()
+    return fetch_one_from_db(f"SELECT mean_loss FROM {config_dict['simulations_table']} WHERE company_id = ?", (company_id,))
     
 
 @app.route('/get_results_by_id/<company_id>', methods=['GET'])
@@ -89,7 +126,27 @@ def get_results_by_id(company_id:int):
             
     except Exception as e:
         logging.error(f'error: {e}')
-        return jsonify({'error': e}), 500
+        return jsonify({'error': str(e)}), 500
+
+
+@lru_cache(maxsize=100)
+def build_segmentation_query(num_revenue_bands: int, num_industries: int) -> str:
+    '''
+    Helper function used to build the SQL query averaging the simulation cost of a segmentation.
+
+    The query text only depends on how many revenue bands and industries are filtered by,
+    so it is built once per shape and cached; the values themselves are bound as parameters.
+    The query expects the industries first, then a (lower, upper) revenue pair per revenue band,
+    and at least one of each.
+    '''
+    revenue_clauses = ["? < c.revenue_usd AND c.revenue_usd <= ?"] * num_revenue_bands
+
+    # A single join lets SQLite use the company_id and (industry, revenue_usd) indexes
+    return f'''SELECT avg(s.mean_loss)
+               FROM {config_dict['simulations_table']} s
+               JOIN {config_dict['synthetic_companies_table']} c ON s.company_id = c.company_id
+               WHERE c.industry IN ({",".join("?" * num_industries)}) AND
+               ({" OR ".join(revenue_clauses)})'''
 
 
 @lru_cache(maxsize=100)
@@ -109,28 +166,22 @@ def fetch_cost_by_revenue_and_industry_from_db(revenue_bands_str:tuple, industri
     revenue_bands = [parse_revenue_band(band) for band in revenue_bands_str]
     bounds = [(revenue_min, revenue_max) for revenue_min, revenue_max in map(get_revenue_boundaries_by_band, revenue_bands)]
 
-    # Dynamically construct the SQL query
-    revenue_clauses, revenue_params, industry_clauses = [], [], [] 
-    for lower, upper in bounds:
-        revenue_clauses.append("? < revenue_usd AND revenue_usd <= ?")
-        revenue_params.extend([lower, upper])
-
-    query_for_companies = f'''SELECT company_id
-               FROM {config_dict['synthetic_companies_table']}
-               WHERE industry IN ({",".join("?" * len(industries_str))}) AND 
-               (revenue_usd < 0 {["","OR (" + " OR ".join(revenue_clauses) + ")"][len(bounds)>0]})'''
-
-    query_for_avg_cost = f"SELECT avg(mean_loss) FROM {config_dict['simulations_table']} WHERE company_id in ({query_for_companies})"
+    revenue_params = [boundary for band_bounds in bounds for boundary in band_bounds]
+    query_for_avg_cost = build_segmentation_query(len(bounds), len(industries_str))
 
     logging.debug(f"full query for results by segmentation: {query_for_avg_cost}")
 
     # Execute the query
-    with sqlite3.connect(config_dict['db_path']) as conn:
-        cursor = conn.cursor()
-        cursor.execute(query_for_avg_cost, list(industries_str) + revenue_params)
-        result = cursor.fetchone() 
-    return result
+    return fetch_one_from_db(query_for_avg_cost, list(industries_str) + revenue_params)
+
+
 
+def parse_list_arg(name: str) -> tuple:
+    '''
+    Helper function used to read a list query parameter, given either as comma-separated
+    values or as repeated parameters (or both), e.g. `revenue=100M,500M` or `revenue=100M&revenue=500M`.
+    '''
+    return tuple(value for arg in request.args.getlist(name) for value in arg.split(',') if value)
 
 
 @app.route('/get_results_by_segmentation', methods=['GET'])
@@ -154,6 +205,14 @@ def get_results_by_segmentation():
             }
 
         Error Response:
+            400:
+            {
+                "error": "invalid revenue bands: ['2B']"
+            }
+            {
+                "error": "missing industries"
+            }
+
             404:
             {
                 "error": "no companies found"
@@ -167,9 +226,23 @@ def get_results_by_segmentation():
 
     try:
         logging.debug(f'start of get_results_by_segmentation GET method')
-        revenue_bands = request.args.getlist('revenue')
-        industries = request.args.getlist('industry')
-        result = fetch_cost_by_revenue_and_industry_from_db(tuple(revenue_bands), tuple(industries))
+        revenue_bands = parse_list_arg('revenue')
+        industries = parse_list_arg('industry')
+
+        if not revenue_bands:
+            logging.error('missing revenue bands')
+            return jsonify({'error': 'missing revenue bands'}), 400
+        if not VALID_REVENUE_BANDS.issuperset(revenue_bands):
+            logging.error(f'invalid revenue bands: {revenue_bands}')
+            return jsonify({'error': f'invalid revenue bands: {sorted(set(revenue_bands) - VALID_REVENUE_BANDS)}'}), 400
+        if not industries:
+            logging.error('missing industries')
+            return jsonify({'error': 'missing industries'}), 400
+        if not VALID_INDUSTRIES.issuperset(industries):
+            logging.error(f'invalid industries: {industries}')
+            return jsonify({'error': f'invalid industries: {sorted(set(industries) - VALID_INDUSTRIES)}'}), 400
+
+        result = fetch_cost_by_revenue_and_industry_from_db(revenue_bands, industries)
         
         if result[0]:
             logging.info(f'average simulation cost for companies in the given segmentation is: {result[0]}')
@@ -180,7 +253,7 @@ def get_results_by_segmentation():
             
     except Exception as e:
         logging.error(f'error: {e}')
-        return jsonify({'error': e}), 500
+        return jsonify({'error': str(e)}), 500
 
 # Run the WebService
 if __name__ == '__main__':
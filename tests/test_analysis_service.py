@@ -1,40 +1,58 @@
 import unittest
-from unittest.mock import patch
+import pytest
+from unittest.mock import patch, ANY, DEFAULT
 import pandas as pd
-from analysis_service import AnalysisService
+import numpy as np
+from analysis_service import AnalysisService, INDUSTRY_NAMES
 from simulation_types import Industry, SimulationMetrics
 
 '''
 The database methods are mocked using unittest.mock.patch to isolate the unit tests from the database.
 Calls to random number generation functions are also mocked to generate predictable outputs for testing.
 The CyberRiskSimulator class is mocked to isolate the AnalysisService class methods during testing.
-The setUp method sets up a DataFrame of synthetic company data that will be used in multiple tests.
+The setUpClass method sets up a DataFrame of synthetic company data that will be used in multiple tests,
+and builds a single AnalysisService, against a mocked database, shared by the tests
+that do not test its construction. The shared database connection is reset for every test.
+The tests only reading from the database use a service that does not generate any companies.
 '''
 
 class TestAnalysisService(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        """
+        Build the AnalysisService shared by the tests once per class.
+        """
+        with patch('analysis_service.sqlite3.connect'), patch('analysis_service._conn', None):
+            cls.service = AnalysisService(num_companies=2)
+
+        # Synthetic company data used by multiple tests, which only read it
+        cls.test_data = pd.DataFrame({
+            'company_id': np.array([1, 2], dtype=np.int32),
+            'revenue_usd': np.array([10, 20], dtype=np.int32),
+            'industry': pd.Categorical(['finance', 'healthcare'], categories=INDUSTRY_NAMES)
+        })
+
     def setUp(self):
         """
         Setup for tests.
         """
-        self.test_data = pd.DataFrame({
-            'company_id': [1, 2],
-            'revenue_usd': [10, 20],
-            'industry': ['finance', 'healthcare']
-        })
-        self.test_data['revenue_usd'] = self.test_data['revenue_usd'].astype('int32')
+        # Each test opens its own database connection, so the patched sqlite3.connect is used
+        conn_patcher = patch('analysis_service._conn', None)
+        conn_patcher.start()
+        self.addCleanup(conn_patcher.stop)
 
     @patch('analysis_service.sqlite3.connect')
     def test_generate_synthetic_companies(self, mock_db_connect):
         """
         Test _generate_synthetic_companies method.
         """
-        with patch('analysis_service.np.random.uniform') as mock_uniform, \
-             patch('analysis_service.np.random.choice') as mock_choice:
+        with patch('analysis_service.np.random.default_rng') as mock_default_rng:
 
             # Mocking the random generation methods
-            mock_uniform.return_value = [10, 20]
-            mock_choice.return_value = ['finance', 'healthcare']
+            mock_default_rng.return_value.uniform.return_value = np.array([9.8, 20.3])
+            mock_default_rng.return_value.integers.return_value = \
+                np.array([INDUSTRY_NAMES.index('finance'), INDUSTRY_NAMES.index('healthcare')], dtype=np.int8)
 
             service = AnalysisService(num_companies=2)
 
@@ -49,8 +67,7 @@ class TestAnalysisService(unittest.TestCase):
         """
         Test _save_synthetic_companies_to_db method.
         """
-        service = AnalysisService(num_companies=2)
-        service._save_synthetic_companies_to_db(self.test_data)
+        self.service._save_synthetic_companies_to_db(self.test_data)
         mock_db_connect.assert_called()
 
     @patch('analysis_service.sqlite3.connect')
@@ -58,36 +75,156 @@ class TestAnalysisService(unittest.TestCase):
         """
         Test _save_simulation_to_db method.
         """
-        service = AnalysisService(num_companies=2)
-        service._save_simulation_to_db(self.test_data)
+        self.service._save_simulation_to_db(self.test_data)
         mock_db_connect.assert_called()
 
-    @patch('analysis_service.CyberRiskSimulator.run_simulation')
-    @patch('analysis_service.CyberRiskSimulator.__init__')
-    def test_run_simulations(self, mock_simulator_init, mock_run_simulation):
+    @patch('analysis_service.AnalysisService._save_simulation_to_db')
+    def test_run_simulations(self, mock_save_simulation_to_db):
         """
         Test run_simulations method.
         """
-        mock_simulator_init.return_value = None  # Mocking the constructor
-        # Mocking the run_simulation method
-        mock_run_simulation.return_value = \
-            SimulationMetrics(total_loss=100, mean_loss=20, median_loss=15, min_loss=5, max_loss=25, std_dev_loss = 3, percentile_95_loss = 2)
+        metrics = SimulationMetrics(total_loss=100, mean_loss=20, median_loss=15, min_loss=5, max_loss=25, std_dev_loss = 3, percentile_95_loss = 2)
 
-        service = AnalysisService(num_companies=2)
-        service.companies = self.test_data
-        service.run_simulations()
+        with patch.multiple('analysis_service.CyberRiskSimulator', __init__=DEFAULT, run_batch_simulation=DEFAULT) as mocks:
+            mocks['__init__'].return_value = None  # Mocking the constructor
+            # Mocking the run_batch_simulation method, each test company is in its own group
+            mocks['run_batch_simulation'].return_value = [metrics]
+
+            self.service.companies = self.test_data
+            self.service.run_simulations(max_workers=1)  # Run in-process so the mocks are used
 
         # Check if the simulator was initialized with the right parameters
-        mock_simulator_init.assert_any_call(industry=Industry.FINANCE, revenue=10)
-        mock_simulator_init.assert_any_call(industry=Industry.HEALTHCARE, revenue=20)
+        mocks['__init__'].assert_any_call(industry=Industry.FINANCE, revenue=10, seed=ANY, attack_seed=ANY)
+        mocks['__init__'].assert_any_call(industry=Industry.HEALTHCARE, revenue=20, seed=ANY, attack_seed=ANY)
+        mocks['run_batch_simulation'].assert_called_with(1)
+        mock_save_simulation_to_db.assert_called_once()
+
+    @patch('analysis_service.AnalysisService._save_simulation_to_db')
+    @patch('analysis_service.SIMULATION_CHUNK_SIZE', 2)
+    def test_run_simulations_splits_groups(self, mock_save_simulation_to_db):
+        """
+        Test run_simulations method splits a group larger than the chunk size into batches.
+        """
+        metrics = SimulationMetrics(total_loss=100, mean_loss=20, median_loss=15, min_loss=5, max_loss=25, std_dev_loss = 3, percentile_95_loss = 2)
+
+        with patch.multiple('analysis_service.CyberRiskSimulator', __init__=DEFAULT, run_batch_simulation=DEFAULT) as mocks:
+            mocks['__init__'].return_value = None  # Mocking the constructor
+            mocks['run_batch_simulation'].side_effect = lambda num_companies: [metrics] * num_companies
+
+            self.service.companies = pd.DataFrame({
+                'company_id': np.arange(1, 6, dtype=np.int32),
+                'revenue_usd': np.full(5, 10, dtype=np.int32),
+                'industry': pd.Categorical(['finance'] * 5, categories=INDUSTRY_NAMES)
+            })
+            self.service.run_simulations(max_workers=1)  # Run in-process so the mocks are used
+
+        self.assertEqual([c.args for c in mocks['run_batch_simulation'].call_args_list], [(2,), (2,), (1,)])
+        results_df = mock_save_simulation_to_db.call_args.args[0]
+        np.testing.assert_array_equal(results_df['company_id'], np.arange(1, 6))
+        np.testing.assert_array_equal(results_df['total_loss'], np.full(5, 100))
+
+    @patch('analysis_service.AnalysisService._save_simulation_to_db')
+    @patch('analysis_service.SIMULATION_CHUNK_SIZE', 2)
+    def test_run_simulations_shares_seeds_across_groups(self, mock_save_simulation_to_db):
+        """
+        Test run_simulations method seeds the batches at the same position of different groups alike.
+        """
+        metrics = SimulationMetrics(total_loss=100, mean_loss=20, median_loss=15, min_loss=5, max_loss=25, std_dev_loss = 3, percentile_95_loss = 2)
+
+        with patch.multiple('analysis_service.CyberRiskSimulator', __init__=DEFAULT, run_batch_simulation=DEFAULT) as mocks:
+            mocks['__init__'].return_value = None  # Mocking the constructor
+            mocks['run_batch_simulation'].side_effect = lambda num_companies: [metrics] * num_companies
+
+            self.service.companies = pd.DataFrame({
+                'company_id': np.arange(1, 7, dtype=np.int32),
+                'revenue_usd': np.full(6, 10, dtype=np.int32),
+                'industry': pd.Categorical(['finance'] * 3 + ['healthcare'] * 3, categories=INDUSTRY_NAMES)
+            })
+            self.service.run_simulations(max_workers=1)  # Run in-process so the mocks are used
+
+        # Two batches per group, in group order
+        attack_seeds = [c.kwargs['attack_seed'] for c in mocks['__init__'].call_args_list]
+        self.assertEqual(len(attack_seeds), 4)
+        self.assertIs(attack_seeds[0], attack_seeds[2])
+        self.assertIs(attack_seeds[1], attack_seeds[3])
+        self.assertIsNot(attack_seeds[0], attack_seeds[1])
+        # The costs of every batch are drawn independently
+        seeds = [c.kwargs['seed'] for c in mocks['__init__'].call_args_list]
+        self.assertEqual(len({id(seed) for seed in seeds + attack_seeds}), 6)
+
+    @patch('analysis_service.AnalysisService._save_simulation_to_db')
+    def test_run_simulations_independent_costs_across_groups(self, mock_save_simulation_to_db):
+        """
+        Test run_simulations method draws independent costs for groups sharing their attack counts.
+        """
+        # Healthcare companies of the 500M and 1B bands have the same attack frequency
+        # and attack costs in a ratio of 1 to 2
+        self.service.companies = pd.DataFrame({
+            'company_id': np.arange(1, 7, dtype=np.int32),
+            'revenue_usd': np.array([300] * 3 + [800] * 3, dtype=np.int32),
+            'industry': pd.Categorical(['healthcare'] * 6, categories=INDUSTRY_NAMES)
+        })
+        self.service.run_simulations(max_workers=1)
+
+        results_df = mock_save_simulation_to_db.call_args.args[0].set_index('company_id')
+        ratios = results_df.loc[[4, 5, 6], 'mean_loss'].to_numpy() / results_df.loc[[1, 2, 3], 'mean_loss'].to_numpy()
+        # Sharing the whole random stream would make every ratio exactly 2
+        self.assertFalse(np.allclose(ratios, 2))
+
+    @patch('analysis_service.AnalysisService._save_simulation_to_db')
+    @patch('analysis_service.sqlite3.connect')
+    def test_run_simulations_reproducible(self, mock_db_connect, mock_save_simulation_to_db):
+        """
+        Test run_simulations method gives the same results for services built with the same seed.
+        """
+        results = []
+        for _ in range(2):
+            service = AnalysisService(num_companies=20, seed=42)
+            service.run_simulations(max_workers=1)
+            results.append(mock_save_simulation_to_db.call_args.args[0].drop(columns='timestamp'))
+
+        pd.testing.assert_frame_equal(results[0], results[1])
+
+    @patch('analysis_service.AnalysisService._save_simulation_to_db')
+    @patch('analysis_service.SIMULATION_CHUNK_SIZE', 4)
+    @patch('analysis_service.sqlite3.connect')
+    def test_run_simulations_in_worker_processes(self, mock_db_connect, mock_save_simulation_to_db):
+        """
+        Test run_simulations method gives the same results in worker processes as in the current process.
+        """
+        results = []
+        for max_workers in (1, 2):
+            service = AnalysisService(num_companies=20, seed=42)
+            service.run_simulations(max_workers=max_workers)
+            results.append(mock_save_simulation_to_db.call_args.args[0].drop(columns='timestamp'))
+
+        pd.testing.assert_frame_equal(results[0], results[1])
+
+    @patch('analysis_service.AnalysisService._save_simulation_to_db')
+    @patch('analysis_service.ProcessPoolExecutor')
+    def test_run_simulations_single_batch_in_process(self, mock_executor, mock_save_simulation_to_db):
+        """
+        Test run_simulations method does not start worker processes for a single batch.
+        """
+        self.service.companies = self.test_data.iloc[:1]
+        self.service.run_simulations()
+
+        mock_executor.assert_not_called()
+        mock_save_simulation_to_db.assert_called_once()
+
+    def test_run_simulations_without_companies(self):
+        """
+        Test run_simulations method raises an error when no companies were generated.
+        """
+        with self.assertRaises(ValueError):
+            AnalysisService(populate=False).run_simulations(max_workers=1)
 
     @patch('analysis_service.sqlite3.connect')
     def test_get_results_from_db(self, mock_db_connect):
         """
         Test get_results_from_db method.
         """
-        service = AnalysisService(num_companies=2)
-        service.get_results_from_db()
+        AnalysisService(populate=False).get_results_from_db()
         mock_db_connect.assert_called()
 
     @patch('analysis_service.sqlite3.connect')
@@ -95,9 +232,8 @@ class TestAnalysisService(unittest.TestCase):
         """
         Test get_synthetic_companies_from_db method.
         """
-        service = AnalysisService(num_companies=2)
-        service.get_synthetic_companies_from_db()
+        AnalysisService(populate=False).get_synthetic_companies_from_db()
         mock_db_connect.assert_called()
 
 if __name__ == '__main__':
-    unittest.main()
+    raise SystemExit(pytest.main([__file__]))
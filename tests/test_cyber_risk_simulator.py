@@ -1,11 +1,18 @@
 import unittest
+import pytest
 from unittest.mock import patch
-from cyber_risk_simulator import CyberRiskSimulator, get_revenue_band_by_revenue, _get_industry_revenue_params  
+from cyber_risk_simulator import CyberRiskSimulator, get_revenue_band_by_revenue, get_revenue_bands_by_revenues, _get_industry_revenue_params, _get_industry_band_params  
 from simulation_types import Industry, RevenueBand, SimulationMetrics
 import numpy as np
 
 class TestCyberRiskSimulator(unittest.TestCase):
 
+    def tearDown(self):
+        """
+        Drop cached industry parameters, so none built from mocked stats leak into other tests.
+        """
+        _get_industry_band_params.cache_clear()
+
     @patch('cyber_risk_simulator._get_industry_revenue_params')
     def test_init(self, mock_get_params):
         """
@@ -42,11 +49,27 @@ class TestCyberRiskSimulator(unittest.TestCase):
         with self.assertRaises(ValueError):
             get_revenue_band_by_revenue(-1)
 
+    def test_get_revenue_bands_by_revenues(self):
+        """
+        Test the vectorized mapping of revenues to revenue bands.
+        """
+        bands = get_revenue_bands_by_revenues(np.array([5, 10, 20, 200, 800]))
+        self.assertEqual(list(bands), [RevenueBand.BAND_10M, RevenueBand.BAND_10M, RevenueBand.BAND_100M,
+                                       RevenueBand.BAND_500M, RevenueBand.BAND_1B])
+
+        # Any revenue out of range should raise an error
+        with self.assertRaises(ValueError):
+            get_revenue_bands_by_revenues(np.array([5, 1001]))
+
+    @patch('cyber_risk_simulator.param_tables_cache', None)
     @patch('cyber_risk_simulator.load_stats')
     def test_get_industry_revenue_params(self, mock_load_stats):
         """
         Test the extraction of frequency and severity parameters for given industry and revenue.
         """
+        # Drop parameters cached from the real stats
+        _get_industry_band_params.cache_clear()
+
         # Mock the stats for different revenue bands in the finance industry
         mock_load_stats.return_value = {
             'finance': {
@@ -63,17 +86,37 @@ class TestCyberRiskSimulator(unittest.TestCase):
         self.assertEqual(_get_industry_revenue_params(Industry.FINANCE, 200), (15, 3000))
         self.assertEqual(_get_industry_revenue_params(Industry.FINANCE, 800), (20, 4000))
 
-    @patch('cyber_risk_simulator.poisson.rvs')
-    @patch('cyber_risk_simulator.norm.rvs')
+        # Industries missing from the stats should raise an error
+        with self.assertRaises(ValueError) as context:
+            _get_industry_revenue_params(Industry.RETAIL, 5)
+        self.assertEqual(str(context.exception), 'Unknown industry: RETAIL')
+
+    @patch('cyber_risk_simulator.np.random.default_rng')
+    @patch('cyber_risk_simulator._get_industry_revenue_params')
+    def test_simulate_attacks(self, mock_get_params, mock_default_rng):
+        """
+        Test that attack counts are sampled by inverting the Poisson CDF.
+        """
+        # For a frequency of 0.3: P(K<=0) ~ 0.741, P(K<=1) ~ 0.963, P(K<=2) ~ 0.996
+        mock_get_params.return_value = (0.3, 5.2)
+        mock_default_rng.return_value.random.return_value = np.array([0.1, 0.8, 0.99, 0.5])
+
+        simulator = CyberRiskSimulator(Industry.HEALTHCARE, 100, num_simulations=4)
+
+        np.testing.assert_array_equal(simulator._simulate_attacks(), [0, 1, 2, 0])
+
+    @patch('cyber_risk_simulator.CyberRiskSimulator._simulate_attacks')
+    @patch('cyber_risk_simulator.np.random.default_rng')
     @patch('cyber_risk_simulator._get_industry_revenue_params')
-    def test_run_simulation(self, mock_get_params, mock_norm_rvs, mock_poisson_rvs):
+    def test_run_simulation(self, mock_get_params, mock_default_rng, mock_simulate_attacks):
         """
         Test running a cyber risk simulation and evaluating the resulting metrics.
         """
         # Mock various return values for functions used in the simulation
         mock_get_params.return_value = (0.3, 5.2)
-        mock_poisson_rvs.return_value = np.array([1, 0, 2, 3, 1])
-        mock_norm_rvs.return_value = 5.2
+        mock_simulate_attacks.return_value = np.array([1, 0, 2, 3, 1])
+        # Every simulation run with attacks loses exactly its mean: 1, 2, 3 and 1 attacks costing 5.2 each
+        mock_default_rng.return_value.standard_normal.return_value = np.zeros(4, dtype=np.float32)
 
         # Create and run the simulator
         simulator = CyberRiskSimulator(Industry.HEALTHCARE, 100)
@@ -87,5 +130,32 @@ class TestCyberRiskSimulator(unittest.TestCase):
         self.assertAlmostEqual(metrics.min_loss, 0)
         self.assertAlmostEqual(metrics.max_loss, 15.6)
 
+    @patch('cyber_risk_simulator.pd.DataFrame.to_csv')
+    @patch('cyber_risk_simulator.CyberRiskSimulator._simulate_attacks')
+    @patch('cyber_risk_simulator.np.random.default_rng')
+    @patch('cyber_risk_simulator._get_industry_revenue_params')
+    def test_run_simulation_save_to_csv(self, mock_get_params, mock_default_rng, mock_simulate_attacks, mock_to_csv):
+        """
+        Test that the per-attack costs are sampled in one batch and summed per simulation run.
+        """
+        mock_get_params.return_value = (0.3, 5.2)
+        mock_simulate_attacks.return_value = np.array([1, 0, 2, 3, 1])
+        # Every attack costs exactly its mean of 5.2
+        mock_default_rng.return_value.standard_normal.return_value = np.zeros(7, dtype=np.float32)
+
+        simulator = CyberRiskSimulator(Industry.HEALTHCARE, 100)
+        metrics = simulator.run_simulation(save_to_csv=True)
+
+        # All 7 attack costs are drawn by a single call
+        mock_default_rng.return_value.standard_normal.assert_called_once_with(7, dtype=np.float32)
+        mock_to_csv.assert_called_once()
+
+        # Validate the per-attack results and the metrics summed from them
+        self.assertEqual(list(simulator.results['simulation_id']), [1, 3, 3, 4, 4, 4, 5])
+        self.assertEqual(list(simulator.results['attack_id']), [1, 1, 2, 1, 2, 3, 1])
+        np.testing.assert_allclose(simulator.results['cost'], 5.2, rtol=1e-6)
+        self.assertAlmostEqual(metrics.total_loss, 36.4, places=5)
+        self.assertAlmostEqual(metrics.max_loss, 15.6, places=5)
+
 if __name__ == '__main__':
-    unittest.main()
+    raise SystemExit(pytest.main([__file__]))
@@ -1,19 +1,28 @@
 import unittest
+import pytest
+import os
+import tempfile
+from datetime import datetime
 from unittest.mock import patch, Mock
-from web_service import app
-import json
+import numpy as np
+import pandas as pd
+import web_service
+from web_service import app, fetch_cost_by_company_from_db, fetch_cost_by_revenue_and_industry_from_db
+import analysis_service
+from analysis_service import AnalysisService, INDUSTRY_NAMES
 
 class TestWebService(unittest.TestCase):
     """
     Unit test class for testing the web service.
     """
 
-    def setUp(self):
+    @classmethod
+    def setUpClass(cls):
         """
-        Set up the test client for Flask application.
+        Set up the test client for Flask application, shared by the tests.
         """
         app.testing = True
-        self.client = app.test_client()
+        cls.client = app.test_client()
 
     def test_welcome(self):
         """
@@ -21,7 +30,7 @@ class TestWebService(unittest.TestCase):
         """
         response = self.client.get('/')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data.decode('utf-8'), 'Hello world from Monte-Carlo simulation web service! :)')
+        self.assertEqual(response.get_data(as_text=True), 'Hello world from Monte-Carlo simulation web service! :)')
 
     @patch('web_service.fetch_cost_by_company_from_db')
     def test_get_results_by_id(self, mock_fetch_cost):
@@ -31,7 +40,7 @@ class TestWebService(unittest.TestCase):
         mock_fetch_cost.return_value = (10000,)
 
         response = self.client.get('/get_results_by_id/12345')
-        json_data = json.loads(response.data.decode('utf-8'))
+        json_data = response.get_json()
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json_data['average simulation cost'], 10000)
@@ -44,11 +53,24 @@ class TestWebService(unittest.TestCase):
         mock_fetch_cost.return_value = None
 
         response = self.client.get('/get_results_by_id/67890')
-        json_data = json.loads(response.data.decode('utf-8'))
+        json_data = response.get_json()
 
         self.assertEqual(response.status_code, 404)
         self.assertEqual(json_data['error'], 'no company found')
 
+    @patch('web_service.fetch_cost_by_company_from_db')
+    def test_get_results_by_id_error(self, mock_fetch_cost):
+        """
+        Test getting results by company ID when the database query fails.
+        """
+        mock_fetch_cost.side_effect = Exception('database is locked')
+
+        response = self.client.get('/get_results_by_id/12345')
+        json_data = response.get_json()
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json_data['error'], 'database is locked')
+
     @patch('web_service.fetch_cost_by_revenue_and_industry_from_db')
     def test_get_results_by_segmentation(self, mock_fetch_cost_by_segmentation):
         """
@@ -57,10 +79,37 @@ class TestWebService(unittest.TestCase):
         mock_fetch_cost_by_segmentation.return_value = (1234.56,)
 
         response = self.client.get('/get_results_by_segmentation?revenue=100M,500M&industry=finance,healthcare')
-        json_data = json.loads(response.data.decode('utf-8'))
+        json_data = response.get_json()
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json_data['average simulation cost'], 1234.56)
+        mock_fetch_cost_by_segmentation.assert_called_once_with(('100M', '500M'), ('finance', 'healthcare'))
+
+    @patch('web_service.fetch_cost_by_revenue_and_industry_from_db')
+    def test_get_results_by_segmentation_invalid_revenue(self, mock_fetch_cost_by_segmentation):
+        """
+        Test getting results by segmentation with an unknown revenue band.
+        """
+        response = self.client.get('/get_results_by_segmentation?revenue=100M,2B&industry=finance')
+        json_data = response.get_json()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json_data['error'], "invalid revenue bands: ['2B']")
+        mock_fetch_cost_by_segmentation.assert_not_called()
+
+    @patch('web_service.fetch_cost_by_revenue_and_industry_from_db')
+    def test_get_results_by_segmentation_missing_parameters(self, mock_fetch_cost_by_segmentation):
+        """
+        Test getting results by segmentation without revenue or industry filters.
+        """
+        for query, error in (('industry=finance', 'missing revenue bands'),
+                             ('revenue=&industry=finance', 'missing revenue bands'),
+                             ('revenue=100M', 'missing industries')):
+            response = self.client.get(f'/get_results_by_segmentation?{query}')
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()['error'], error)
+        mock_fetch_cost_by_segmentation.assert_not_called()
 
     @patch('web_service.fetch_cost_by_revenue_and_industry_from_db')
     def test_get_results_by_segmentation_no_companies(self, mock_fetch_cost_by_segmentation):
@@ -70,10 +119,78 @@ class TestWebService(unittest.TestCase):
         mock_fetch_cost_by_segmentation.return_value = (None,)
 
         response = self.client.get('/get_results_by_segmentation?revenue=100M,500M&industry=finance,healthcare')
-        json_data = json.loads(response.data.decode('utf-8'))
+        json_data = response.get_json()
 
         self.assertEqual(response.status_code, 404)
         self.assertEqual(json_data['error'], 'no companies found')
 
+
+class TestWebServiceDatabase(unittest.TestCase):
+    """
+    Unit test class running the web service queries against a temporary SQLite database,
+    filled by the AnalysisService the same way the simulations are saved.
+    """
+
+    def setUp(self):
+        """
+        Point both services at a temporary database and save a few companies and simulations to it.
+        """
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        db_path = os.path.join(tmp_dir.name, 'test.db')
+
+        for patcher in (patch.dict(analysis_service.config_dict, {'db_path': db_path}),
+                        patch.dict(web_service.config_dict, {'db_path': db_path}),
+                        patch('analysis_service._conn', None),
+                        patch('web_service._conn', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Registered last so the connections are closed before the patches are undone
+        self.addCleanup(self.close_connections)
+
+        service = AnalysisService(populate=False)
+        service._save_synthetic_companies_to_db(pd.DataFrame({
+            'company_id': np.array([1, 2, 3, 4], dtype=np.int32),
+            'revenue_usd': np.array([5, 50, 200, 50], dtype=np.int32),
+            'industry': pd.Categorical(['finance', 'finance', 'healthcare', 'healthcare'], categories=INDUSTRY_NAMES)
+        }))
+        # Company 1 was simulated twice
+        service._save_simulation_to_db(pd.DataFrame({
+            'company_id': [1, 1, 2, 3, 4],
+            'total_loss': [100.0, 200.0, 300.0, 400.0, 500.0],
+            'mean_loss': [10.0, 20.0, 30.0, 40.0, 50.0],
+            'timestamp': datetime.now()
+        }))
+
+    @staticmethod
+    def close_connections():
+        """
+        Close the connections opened to the temporary database.
+        """
+        for conn in (analysis_service._conn, web_service._conn):
+            if conn is not None:
+                conn.close()
+
+    def test_fetch_cost_by_company(self):
+        """
+        Test fetching the simulation cost of a company.
+        """
+        self.assertEqual(fetch_cost_by_company_from_db.__wrapped__(2), (30.0,))
+        self.assertIsNone(fetch_cost_by_company_from_db.__wrapped__(5))
+
+    def test_fetch_cost_by_revenue_and_industry(self):
+        """
+        Test averaging the simulation cost of the companies in a segmentation.
+        """
+        fetch = fetch_cost_by_revenue_and_industry_from_db.__wrapped__
+
+        # Companies 2 and 4 are the only ones in the 100M band
+        self.assertEqual(fetch(('100M',), ('finance', 'healthcare')), (40.0,))
+        # Companies 1, simulated twice, and 2
+        self.assertEqual(fetch(('10M', '100M'), ('finance',)), (20.0,))
+        self.assertEqual(fetch(('500M',), ('healthcare',)), (40.0,))
+        # No company matches
+        self.assertEqual(fetch(('500M',), ('finance',)), (None,))
+
 if __name__ == '__main__':
-    unittest.main()
+    raise SystemExit(pytest.main([__file__]))